@@ -5,12 +5,23 @@ Created on Wed May 31 23:59:25 2017
 @author: Colin-N. Brosseau
 """
 import numpy as np
-import pandas as pd
+import re
 import bz2
 import glob
+import html
+import io
+import itertools
+import json
+import operator
 import os
-import xmltodict
-from xml.parsers.expat import ExpatError  # for xmltodict
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from lxml import etree
+except ImportError:
+    # Fall back on the regular expression parser (see _parse_regex)
+    etree = None
 
 # import matplotlib.pylab as plt
 
@@ -32,13 +43,51 @@ Remarks:
     to 88-89.
 """
 
+# Read buffer size (bytes) for the decompressed status files
+BUFFER_SIZE = 256 * 1024
+
+# Size (bytes) of the beginning of a status file holding its update time
+HEAD_SIZE = 4 * 1024
+
+# Number of bikes marking a missing observation (biggest station is 89 docks)
+MISSING = 255
+
+# Status files are small: they are parsed in a single call to libxml2,
+# dropping the whitespace, comments and processing instructions between
+# elements (only elements are children of the parsed stations)
+if etree is not None:
+    _XML_PARSER = etree.XMLParser(remove_blank_text=True, remove_comments=True, remove_pis=True)
+
+# Schema of the status files, for the parser without lxml (and to read only
+# the update time)
+_STATIONS_PATTERN = re.compile(rb'<stations\b[^>]*?\bLastUpdate="([^"]*)"')
+_STATION_PATTERN = re.compile(rb'<station>(.*?)</station>', re.S)
+_FIELD_PATTERN = re.compile(rb'<(\w+)(?:\s*/>|>([^<]*)</\1>)')
+
+# Typed fields of a station (see bixi2dict), stored as arrays in the parse
+# cache. Other fields are stored as JSON.
+_CACHED_FIELDS = {
+    'id': np.int32,
+    'terminalName': np.int32,
+    'nbBikes': np.int32,
+    'nbEmptyDocks': np.int32,
+    'lastUpdateTime': np.uint32,
+    'lastCommWithServer': np.uint32,
+    'installed': np.bool_,
+    'locked': np.bool_,
+    'public': np.bool_,
+    'temporary': np.bool_,
+    'lat': np.float64,
+    'long': np.float64,
+    }
+
 class BadXMLFile(Exception):
     """
     Represents a bad .xml file.
     """
     pass
 
-def read_raw(year, month=None, day=None, directory='.', verbose=0):
+def read_raw(year, month=None, day=None, directory='.', verbose=0, n_jobs=None, cache=True):
     """
     Read all available raw data for a day, a month or a year.
 
@@ -77,6 +126,17 @@ def read_raw(year, month=None, day=None, directory='.', verbose=0):
         Level of verbosity
 
 
+    n_jobs : int
+    
+        Number of processes used to parse the files.
+        If None, use as many processes as there are CPUs.
+
+
+    cache : bool
+    
+        Use (and create) the parse cache of each file. See bixi2dict.
+
+
     Returns
     -------
     time_vector: int, shape (n_measurements,)
@@ -119,27 +179,83 @@ def read_raw(year, month=None, day=None, directory='.', verbose=0):
         list_filename = sorted(glob.glob(os.path.join(directory, "%04d-%02d-%02d_*.xml.bz2" % (year, month, day))))
     
     bn = bixi_newtork()
-    i = 0
-    for filename in list_filename:
-        i += 1
-        if verbose > 0:
-            print(str(i) + "/" + str(len(list_filename))  +  "   " + filename)
-        try:
-            ddd, last_update = bixi2dict(filename)
-            bn.add(ddd, last_update)
-        except BadXMLFile:
-            pass
+    # Files are independent, parse them in parallel and add them in order
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        # The server is refreshed less often than the files are taken: only
+        # parse one file per update time. The other files with the same 
+        # update time are kept in case this one turns out to be bad.
+        updates = executor.map(_last_update_or_none, list_filename, itertools.repeat(cache), chunksize=8)
+        groups = []
+        group_of_update = {}
+        for filename, update in zip(list_filename, updates):
+            if update is None:
+                groups.append([filename])
+            elif update in group_of_update:
+                group_of_update[update].append(filename)
+            else:
+                group_of_update[update] = [filename]
+                groups.append(group_of_update[update])
+        if verbose > 1:
+            print(str(len(list_filename) - len(groups)) + " files skipped (no new update)")
+        
+        results = executor.map(_bixi2dict_or_none, [group[0] for group in groups], itertools.repeat(cache), chunksize=8)
+        for i, (group, result) in enumerate(zip(groups, results), 1):
+            if verbose > 0:
+                print(str(i) + "/" + str(len(groups))  +  "   " + group[0])
+            # Bad file: fall back on the next file with the same update time
+            for filename in group[1:]:
+                if result is not None:
+                    break
+                if verbose > 0:
+                    print("      retry " + filename)
+                result = _bixi2dict_or_none(filename, cache)
+            if result is not None:
+                ddd, last_update = result
+                bn.add(ddd, last_update)
         
     return bn
 
 
+def _bixi2dict_or_none(filename, cache=True):
+    """
+    Same as bixi2dict, but return None for a bad .xml file.
+    """
+    try:
+        return bixi2dict(filename, cache)
+    except BadXMLFile:
+        return None
+
+
+def _last_update_or_none(filename, cache=True):
+    """
+    Same as bixi_last_update, but return None for a bad .xml file or if
+    the file is cached (loading the cache is cheaper than reading the file).
+    """
+    if cache and _is_cached(filename):
+        return None
+    try:
+        return bixi_last_update(filename)
+    except BadXMLFile:
+        return None
+
+
 class bixi_newtork():
     """
     Contains informations related to the whole bixi network (all stations).
     """
     def __init__(self):
         self.last_update = 0
+        # All update times already added
+        self.seen_updates = set()
         self.stations = {}
+        # Column of each station ('terminalName') in the matrix of bikes
+        self.columns = {}
+        # One row of the matrix of bikes per added update: update time,
+        # then columns (int16) and number of bikes (uint8) of the stations
+        # present, stored as compact arrays
+        self._update_times = []
+        self._row_columns = []
+        self._row_bikes = []
         
     def add(self, d, update_time):
         """
@@ -149,8 +265,13 @@ class bixi_newtork():
         """
         
         # only add informations if they are new
-        if update_time != self.last_update:
+        # (any update time already added is skipped, so the rows of the
+        # matrix of bikes have distinct times)
+        if update_time not in self.seen_updates:
+            self.seen_updates.add(update_time)
             self.last_update = update_time
+            columns = []
+            bikes = []
             for i in d:
                 station_name = i['terminalName']
                 try:
@@ -158,13 +279,163 @@ class bixi_newtork():
                 except KeyError:
                     self.stations[station_name] = station()
                     self.stations[station_name].add(i)
-                    
+                    self.columns[station_name] = len(self.columns)
+                columns.append(self.columns[station_name])
+                bikes.append(i['nbBikes'])
+            self._update_times.append(update_time)
+            self._row_columns.append(np.array(columns, dtype=np.int16))
+            self._row_bikes.append(np.array(bikes, dtype=np.uint8))
+
+    def to_array(self):
+        """
+        Gather the number of bikes of all stations in a single matrix.
+        
+        There is one row per update of the network (see add), so each row 
+        is a snapshot of all the stations.
+
+
+        Returns
+        -------
+        time_vector : uint32, shape (n_measurements,)
+        
+            Sorted update times of the network.
+
+
+        terminal_names : int, shape (n_stations,)
+        
+            Sorted 'terminalName' of the stations. Column index of bikes.
+
+
+        bikes : uint8, shape (n_measurements, n_stations)
+        
+            Number of available bikes. MISSING where a station is absent
+            from that update.
+        """
+        names = np.array(list(self.columns), dtype=np.int64)
+        # Columns are attributed as stations appear: sort them by name
+        order = np.argsort(names)
+        terminal_names = names[order]
+        new_columns = np.empty(len(order), dtype=np.intp)
+        new_columns[order] = np.arange(len(order))
+        
+        # Flatten all the rows, then fill the matrix in a single operation
+        all_rows = np.repeat(np.arange(len(self._update_times)),
+                             [len(columns) for columns in self._row_columns])
+        all_columns = new_columns[np.concatenate(self._row_columns + [np.array([], dtype=np.int16)])]
+        all_bikes = np.concatenate(self._row_bikes + [np.array([], dtype=np.uint8)])
+        bikes = np.full((len(self._update_times), len(terminal_names)), MISSING, dtype=np.uint8)
+        bikes[all_rows, all_columns] = all_bikes
+        
+        # Updates are added in file order, which may not be chronological
+        time_vector = np.array(self._update_times, dtype=np.uint32)
+        order = np.argsort(time_vector, kind='stable')
+        time_vector = time_vector[order]
+        bikes = bikes[order]
+        return time_vector, terminal_names, bikes
+
+    def save(self, directory):
+        """
+        Save the matrix of bikes (see to_array) and the metadata of the 
+        stations in a directory.
+        
+        Each array is saved uncompressed in its own .npy file 
+        (time_vector.npy, terminal_names.npy, bikes.npy), so it can be 
+        memory-mapped by load_array. The metadata of the stations is saved 
+        in metadata.json (see load_metadata).
+        """
+        os.makedirs(directory, exist_ok=True)
+        time_vector, terminal_names, bikes = self.to_array()
+        for name, array in (('time_vector', time_vector), 
+                            ('terminal_names', terminal_names), 
+                            ('bikes', bikes)):
+            np.save(os.path.join(directory, name + '.npy'), array)
+        with open(os.path.join(directory, 'metadata.json'), 'w') as file:
+            json.dump({str(name): self.stations[name].metadata for name in terminal_names}, file)
+
+
+def load_array(directory, mmap_mode='r'):
+    """
+    Load a matrix of bikes saved by bixi_newtork.save.
+
+
+    Parameters
+    ----------
+    directory : str
+    
+        Directory given to bixi_newtork.save.
+
+
+    mmap_mode : str
+    
+        See numpy.load. By default, the arrays are memory-mapped (read 
+        only): the data is only read from the disk when accessed.
+
+
+    Returns
+    -------
+    Same as bixi_newtork.to_array.
+    """
+    return tuple(np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) 
+                 for name in ('time_vector', 'terminal_names', 'bikes'))
+
+
+def load_metadata(directory):
+    """
+    Load the metadata of the stations saved by bixi_newtork.save.
+
+
+    Returns
+    -------
+    metadata : dict
+    
+        Each element is the list of metadata (see station) of the 
+        corresponding station (key is 'terminalName').
+    """
+    with open(os.path.join(directory, 'metadata.json')) as file:
+        return {int(name): metadata for name, metadata in json.load(file).items()}
+
+
+def load_range(directories):
+    """
+    Load and stack several matrices of bikes saved by bixi_newtork.save 
+    (e.g. one per day).
+
+
+    Parameters
+    ----------
+    directories : list of str
+    
+        Directories given to bixi_newtork.save, in chronological order 
+        and not overlapping in time.
+
+
+    Returns
+    -------
+    Same as bixi_newtork.to_array. Stations are all the stations found in 
+    any directory, MISSING where a station is absent from a directory.
+    """
+    list_arrays = [load_array(directory) for directory in directories]
+    terminal_names = np.unique(np.concatenate([names for _, names, _ in list_arrays]
+                                              + [np.array([], dtype=np.int64)]))
+    n_times = sum(len(time_vector) for time_vector, _, _ in list_arrays)
+    
+    # Fill the output once, the memory-mapped data is read along the way
+    time_vector = np.empty(n_times, dtype=np.uint32)
+    bikes = np.full((n_times, len(terminal_names)), MISSING, dtype=np.uint8)
+    start = 0
+    for times, names, b in list_arrays:
+        stop = start + len(times)
+        time_vector[start:stop] = times
+        bikes[start:stop, np.searchsorted(terminal_names, names)] = b
+        start = stop
+    return time_vector, terminal_names, bikes
+
+
+# Fields of a station compared to detect a change of its metadata (along
+# with its total number of docks)
+_META_KEYS = ('id', 'name', 'lat', 'long', 'installed', 'locked', 'public', 'temporary')
+_get_meta = operator.itemgetter(*_META_KEYS)
 
-def equal_dicts(d1, d2, ignore_keys):
-    d1_filtered = dict((k, v) for k,v in d1.items() if k not in ignore_keys)
-    d2_filtered = dict((k, v) for k,v in d2.items() if k not in ignore_keys)
-    return d1_filtered == d2_filtered
-            
 
 class station():
     """
@@ -174,10 +445,34 @@ class station():
         # Metadata of the station
         # list of dictionnaries
         self.metadata = []
+        # Last metadata as a tuple (_META_KEYS + numDocks)
+        self._last_meta = None
         # Time of observation (unix time)
-        self.measure_time = np.array([], dtype=np.uint32)
+        # Accumulated in lists, converted to arrays on access
+        self._measure_time = []
         # Number of available bikes
-        self.bikes = np.array([], dtype=np.uint8)  # biggest station is 89 docks
+        self._bikes = []
+        self._arrays = None
+
+    @property
+    def measure_time(self):
+        """
+        Time of observation (unix time), uint32 array.
+        """
+        return self._as_arrays()[0]
+
+    @property
+    def bikes(self):
+        """
+        Number of available bikes, uint8 array.
+        """
+        return self._as_arrays()[1]
+
+    def _as_arrays(self):
+        if self._arrays is None:
+            self._arrays = (np.asarray(self._measure_time, dtype=np.uint32),
+                            np.asarray(self._bikes, dtype=np.uint8))  # biggest station is 89 docks
+        return self._arrays
     
     def add(self, d):
         """
@@ -186,33 +481,30 @@ class station():
         d : 
             dictionnary reprensenting the state of the station
         """
-        dic = d.copy()
-
-        # Changing informations
-        try:
-            # Update only if there is new information in the numer of bikes
-            if dic['lastUpdateTime'] != self.measure_time[-1]:
-                self.measure_time = np.append(self.measure_time, dic['lastUpdateTime'])
-                self.bikes = np.append(self.bikes, dic['nbBikes'])
-        except IndexError:
-                self.measure_time = np.array([dic['lastUpdateTime']], dtype=np.uint32)
-                self.bikes = np.array([dic['nbBikes']], dtype=np.uint8)
-
+        update_time = d['lastUpdateTime']
+        bikes = d['nbBikes']
         # Total number of docks
-        dic['numDocks'] = dic['nbBikes'] + dic['nbEmptyDocks']
+        num_docks = bikes + d['nbEmptyDocks']
 
-        # Delete informations not related to metadata
-        del dic['lastCommWithServer']
-        del dic['nbBikes']
-        del dic['nbEmptyDocks']
-        try:
-            # Update only if metadata changed
-            if not equal_dicts(dic, self.metadata[-1], 'lastUpdateTime'):
-                self.metadata.append(dic)
-        except IndexError:
-            self.metadata = [dic]
-
-def bixi2dict(filename):
+        # Changing informations
+        # Update only if there is new information in the numer of bikes
+        if not self._measure_time or update_time != self._measure_time[-1]:
+            self._measure_time.append(update_time)
+            self._bikes.append(bikes)
+            self._arrays = None
+
+        # Update only if metadata changed
+        meta = _get_meta(d) + (num_docks,)
+        if meta == self._last_meta:
+            return
+        self._last_meta = meta
+        # Keep only informations related to metadata
+        dic = {key: value for key, value in d.items() 
+               if key not in ('lastCommWithServer', 'nbBikes', 'nbEmptyDocks')}
+        dic['numDocks'] = num_docks
+        self.metadata.append(dic)
+
+def bixi2dict(filename, cache=True):
     """
     Extract content of a bixi status file to a dictionnary.
     
@@ -225,6 +517,13 @@ def bixi2dict(filename):
         Files are taken from https://montreal.bixi.com/data/bikeStations.xml
 
 
+    cache : bool
+    
+        If True, the parsed content is saved next to the file 
+        (filename + '.parsed.npz') and loaded from there on subsequent 
+        calls, as long as it is not older than the file.
+
+
     Returns
     -------
     stations : list of dicts
@@ -283,84 +582,240 @@ def bixi2dict(filename):
         last_update : int
             last update time of the network (Unix time)
     """
-    def xmlbz2todict(filename):
-        """
-        Convert a bz2-ed xml file to a dictionnary
+    cache_filename = _cache_filename(filename)
+    if cache and _is_cached(filename):
+        try:
+            return _load_parsed(cache_filename)
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            # Unusable (e.g. empty or corrupted) cache, parse the file
+            pass
+    
+    # A large read buffer amortizes the calls to the bz2 decompressor
+    file = io.BufferedReader(bz2.BZ2File(filename, 'rb'), buffer_size=BUFFER_SIZE)
+    try:
+        if etree is not None:
+            last_update, raw_stations = _parse_lxml(file, filename)
+        else:
+            last_update, raw_stations = _parse_regex(file.read(), filename)
+    finally:
+        file.close()
+    
+    list_stations = []
+    for station in raw_stations:
+        try:
+            station.update({
+                'id': int(station['id']),
+                'name': _intern(station['name']),
+                'terminalName': int(station['terminalName']),
+                'nbBikes': int(station['nbBikes']),
+                'nbEmptyDocks': int(station['nbEmptyDocks']),
+                # put time in Unix time
+                'lastUpdateTime': int(station['lastUpdateTime']) // 1000,
+                'lastCommWithServer': int(station['lastCommWithServer']) // 1000,
+                'installed': station['installed'] == 'true',
+                'locked': station['locked'] == 'true',
+                'public': station['public'] == 'true',
+                'temporary': station['temporary'] == 'true',
+                'lat': float(station['lat']),
+                'long': float(station['long']),
+                })
+        except TypeError:
+            """
+            Skip this kind of buggy data:
+            {'id': '595', 'name': '4000', 'terminalName': '4000', 
+            'lastCommWithServer': None, 'lat': '0', 'long': '0', 'installed': 'true', 
+            'locked': 'false', 'installDate': None, 'removalDate': None, 
+            'temporary': 'false', 'public': 'true', 'nbBikes': '0', 
+            'nbEmptyDocks': '0', 'lastUpdateTime': '0'}
+            """
+            continue
+        list_stations.append(station)
+    
+    if cache:
+        try:
+            _save_parsed(cache_filename, list_stations, last_update)
+        except (OSError, ValueError, OverflowError):
+            # The cache is optional: e.g. read-only directory, or a value 
+            # out of the range of its array
+            pass
+        
+    return list_stations, last_update
 
 
-        Parameters
-        ----------
-        filename : str
-        
-            File to import. Must be in format .xml.
-            
+def bixi_last_update(filename):
+    """
+    Read only the last update time of a bixi status file.
+
+    Much cheaper than bixi2dict: only the beginning of the file is
+    decompressed and no xml is parsed.
+
+
+    Parameters
+    ----------
+    filename : str
     
-        Returns
-        -------
-        list_stations : list
-            List of dictionnaries. Each dictionnary represent the state of a station a a given time.
-        last_update : int
-            Last update of the xml file. Unix time * 1000
-        """
-        file = bz2.BZ2File(filename, 'rb')
-        try:
-            return xmltodict.parse(file, xml_attribs=True) 
-        except ExpatError:
-            raise BadXMLFile(filename)         
+        File to read. Must be in format .xml.bz2. 
+
 
-    d = xmlbz2todict(filename)['stations']
+    Returns
+    -------
+    last_update : int
+        last update time of the network (Unix time)
+    """
+    with bz2.BZ2File(filename, 'rb') as file:
+        head = file.read(HEAD_SIZE)
+    match = _STATIONS_PATTERN.search(head)
+    if match is None:
+        raise BadXMLFile(filename)
     try:
-        last_update = int(int(d['@LastUpdate'])/1000)
+        return int(match.group(1)) // 1000
     except ValueError:
         raise BadXMLFile(filename)
-    list_stations = d['station']
+
+
+def _cache_filename(filename):
+    """
+    Name of the parse cache of a status file (see bixi2dict).
+    """
+    return filename + '.parsed.npz'
+
+
+def _is_cached(filename):
+    """
+    True if the parse cache of a status file exists and is up to date.
+    """
+    try:
+        return os.path.getmtime(_cache_filename(filename)) >= os.path.getmtime(filename)
+    except OSError:
+        return False
+
+
+def _save_parsed(filename, list_stations, last_update):
+    """
+    Save the output of bixi2dict in a .npz file.
     
-#    for station in list_stations:
-    for i, station in enumerate(list_stations):
+    The typed fields are saved as arrays, the others (name, dates, ...) as
+    a JSON string.
+    """
+    arrays = {key: np.array([station[key] for station in list_stations], dtype=dtype)
+              for key, dtype in _CACHED_FIELDS.items()}
+    others = [{key: value for key, value in station.items() if key not in _CACHED_FIELDS}
+              for station in list_stations]
+    # Write to a temporary file first, so an interrupted write never leaves
+    # a partial cache behind
+    temp_filename = filename + '.tmp'
+    try:
+        with open(temp_filename, 'wb') as file:
+            np.savez(file, last_update=last_update, others=json.dumps(others), **arrays)
+        os.replace(temp_filename, filename)
+    except BaseException:
         try:
-#            print(' ')
-#            print(station)
-            list_int = ['id', 'lastCommWithServer', 'lastUpdateTime', 'nbBikes', 'nbEmptyDocks', 'terminalName']
-            for key in list_int:
-                station[key] = int(station[key])
-            list_bool = ['installed', 'locked', 'public', 'temporary']
-            for key in list_bool:
-                station[key] = bool(station[key])
-            list_float = ['lat', 'long']
-            for key in list_float:
-                station[key] = float(station[key])
-                
-            # put time in Unix time
-            station['lastUpdateTime'] = int(station['lastUpdateTime']/1000)
-            station['lastCommWithServer'] = int(station['lastCommWithServer']/1000)
-        except TypeError:
-            del list_stations[i]
-            """
-            Delete this kind of buggy data:
-            OrderedDict([('id', '595'), ('name', '4000'), ('terminalName', '4000'), 
-            ('lastCommWithServer', None), ('lat', '0'), ('long', '0'), ('installed', 'true'), 
-            ('locked', 'false'), ('installDate', None), ('removalDate', None), 
-            ('temporary', 'false'), ('public', 'true'), ('nbBikes', '0'), 
-            ('nbEmptyDocks', '0'), ('lastUpdateTime', '0')])
-            """
-        
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+
+
+def _load_parsed(filename):
+    """
+    Load a file saved by _save_parsed. Same returns as bixi2dict.
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        columns = {key: data[key].tolist() for key in _CACHED_FIELDS}
+        list_stations = json.loads(str(data['others']),
+                                   object_pairs_hook=lambda pairs: {sys.intern(key): value for key, value in pairs})
+        last_update = int(data['last_update'])
+    for i, station in enumerate(list_stations):
+        station['name'] = _intern(station['name'])
+        for key in _CACHED_FIELDS:
+            station[key] = columns[key][i]
     return list_stations, last_update
+
+
+def _intern(text):
+    """
+    Intern a string repeated in every file (field or station name), so it is
+    stored once and compares by identity. None is returned unchanged.
+    """
+    if text is None:
+        return None
+    return sys.intern(text)
+
+
+def _parse_lxml(file, filename):
+    """
+    Parse a status file with lxml.
+
+    Return the last update time (Unix time) and an iterator over the
+    stations, as dictionnaries of raw strings (None for empty fields).
+    """
+    try:
+        root = etree.parse(file, _XML_PARSER).getroot()
+    except etree.XMLSyntaxError:
+        raise BadXMLFile(filename)
+    try:
+        last_update = int(root.get('LastUpdate')) // 1000
+    except (TypeError, ValueError):
+        raise BadXMLFile(filename)
+    return last_update, ({sys.intern(child.tag): child.text for child in elem}
+                         for elem in root.iterchildren('station'))
+
+
+def _parse_regex(data, filename):
+    """
+    Parse the content (bytes) of a status file with regular expressions.
+
+    Only valid for the known (flat) schema of the status files. Same
+    returns as _parse_lxml.
+    """
+    match = _STATIONS_PATTERN.search(data)
+    if match is None:
+        raise BadXMLFile(filename)
+    try:
+        last_update = int(match.group(1)) // 1000
+    except ValueError:
+        raise BadXMLFile(filename)
+    bodies = _STATION_PATTERN.findall(data, match.end())
+    # Reject truncated documents (as lxml does): every opened station must
+    # be closed, and the document must end with </stations>
+    if (data.count(b'<station>', match.end()) != len(bodies) 
+            or not data.rstrip().endswith(b'</stations>')):
+        raise BadXMLFile(filename)
+    return last_update, ({sys.intern(tag.decode()): _unescape(text) for tag, text in _FIELD_PATTERN.findall(body)}
+                         for body in bodies)
+
+
+def _unescape(text):
+    """
+    Decode the text of a xml element. Empty text gives None (as lxml).
+    """
+    if not text:
+        return None
+    text = text.decode('utf-8')
+    if '&' in text:
+        text = html.unescape(text)
+    return text
         
 
-def resample_time(x_in, y_in, rule='T'):
+def resample_time(x_in, y_in, rule='2T'):
     """
     Convert y_in versus x_in to a new x-axis period.
     
-    The new axis is evenly spaced.
+    The new axis is evenly spaced. Each new point takes the last value
+    measured at or before it. A point before the first measurement takes
+    the value of the following new point.
+    
+    Values equal to MISSING are skipped: the last valid value is carried
+    forward instead. A station stays MISSING until its first valid value.
     
     Parameters
     ----------
     x_in : array, shape (n_measurements,)
     
-        Initial x-axis
+        Initial x-axis (Unix time), sorted.
 
 
-    y_in : array, shape (n_measurements,)
+    y_in : array, shape (n_measurements,) or (n_measurements, n_stations)
     
         Initial values for each point of x_in.
 
@@ -377,27 +832,57 @@ def resample_time(x_in, y_in, rule='T'):
 
     Returns
     -------
-    x_out: uint32, shape (n_measurements,)
+    x_out: uint32, shape (n_resampled,)
     
         Resampled x-axis
 
 
-    y_out: uint8, shape (n_measurements,)
+    y_out: uint8, shape (n_resampled,) or (n_resampled, n_stations)
     
         Resampled y_in over x_out
 
 
     """
-    x = x_in.copy()
-    y = y_in.copy()
-    x = pd.to_datetime(x, unit='s')
-    df = pd.DataFrame(data={'y':y}, index=x)
-    df = df.resample('2T').pad().bfill()
+    period = _rule2seconds(rule)
+    x = np.asarray(x_in, dtype=np.int64).ravel()
+    y = np.asarray(y_in)
     
-    x_out = np.array(df.index.astype(np.int64).values // 10**9, dtype=np.uint32)
-    y_out = np.squeeze(np.array(df.values, dtype=np.uint8))
+    x_out = np.arange(x[0] // period * period, x[-1] // period * period + 1, period)
+    # Index of the last measurement at or before each new point
+    idx = np.searchsorted(x, x_out, side='right') - 1
+    # Only the first point can precede the first measurement: back fill it
+    if idx[0] < 0:
+        idx[0] = idx[1] if len(idx) > 1 else 0
+    
+    x_out = x_out.astype(np.uint32)
+    if not np.any(y == MISSING):
+        return x_out, np.asarray(y[idx], dtype=np.uint8)
+    
+    # Carry the last valid value forward, one column at a time so only
+    # vectors of length n_measurements are allocated
+    columns = y.reshape(len(x), -1)
+    y_out = np.full((len(idx), columns.shape[1]), MISSING, dtype=np.uint8)
+    for col in range(columns.shape[1]):
+        column = columns[:, col]
+        valid = np.flatnonzero(column != MISSING)
+        # Last valid row at or before each gathered row
+        pos = np.searchsorted(valid, idx, side='right') - 1
+        found = pos >= 0
+        y_out[found, col] = column[valid[pos[found]]]
+    y_out = y_out.reshape((len(idx),) + y.shape[1:])
 
     return x_out, y_out
+
+
+def _rule2seconds(rule):
+    """
+    Convert a resampling rule (see resample_time) to a period in seconds.
+    """
+    match = re.fullmatch(r'(\d*)([HTS])', rule)
+    if match is None:
+        raise ValueError("Unknown resampling rule: " + rule)
+    multiple = int(match.group(1) or 1)
+    return multiple * {'H': 3600, 'T': 60, 'S': 1}[match.group(2)]
     
 
 if __name__ == '__main__':